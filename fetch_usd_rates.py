@@ -6,6 +6,14 @@ Fetch daily USD exchange rates from exchangerate.host and upsert into a Supabase
 - Backfills a date range (default: 2020-01-01 to today) using the /timeframe endpoint (<=365 days per call).
 - Optionally limits to a list of currency codes, or fetches ALL supported currencies.
 - Bulk upserts rows into the `exchange_rates` table (primary key on (rate_date, base_currency, symbol)).
+- Caches API responses on disk (requests-cache, `http_cache` in config.yaml) so reruns over historical
+  ranges cost no API requests; only a chunk that includes today is refetched (after 1 hour).
+- Skips chunks whose dates already have a rate for every requested symbol (`skip_existing` in config.yaml),
+  so incremental daily runs only fetch the chunk that includes today.
+- Caps API calls per run (`max_requests_per_run`) and per calendar month (`monthly_request_quota`, tracked
+  across runs in `quota_state`); chunks beyond the budget are skipped and picked up by a later run.
+- Upsert batches default to 5000 rows and are also capped by payload size (`max_upsert_payload_bytes`,
+  default 6 MB); Supabase/PostgREST typically tolerates 5-10 MB request bodies.
 
 Usage examples:
   python fetch_usd_rates.py --start 2020-01-01 --end today --symbols CAD,EUR,GBP,AED,TRY
@@ -16,17 +24,31 @@ Environment variables required:
   SUPABASE_URL                # e.g., https://YOUR-PROJECT.supabase.co
   SUPABASE_SERVICE_ROLE_KEY   # Service Role key for server-side upserts
   EXCHANGERATE_HOST_KEY       # (Free) API key from https://exchangerate.host (100 requests/mo on free)
+
+Optional:
+  SUPABASE_DB_URL             # Direct Postgres connection string; when set, rows are upserted over
+                              # psycopg2 (unnest of column arrays) instead of the PostgREST API (much faster for backfills)
 """
 
 import argparse
+import contextlib
 import datetime as dt
+import functools
+import itertools
+import json
 import os
+import queue
+import random
 import sys
+import threading
 import time
-from typing import Dict, Iterable, List, Optional, Tuple
+from collections import Counter, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 import yaml
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 try:
@@ -35,12 +57,58 @@ except Exception as e:
     print("Missing dependency 'supabase'. Install with: pip install supabase")
     raise
 
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    # Optional: stdlib json is ~2-3x slower on large /timeframe bodies and upsert payloads
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+try:
+    from requests_cache import NEVER_EXPIRE, CachedSession
+except ImportError:
+    # Optional: without it every run hits the API
+    CachedSession = None
+
+try:
+    import psycopg2
+    from psycopg2 import sql as pgsql
+except ImportError:
+    # Only needed when SUPABASE_DB_URL is set
+    psycopg2 = None
+
 load_dotenv()
 
+MAX_FETCH_ATTEMPTS = 6
+
+# API error types worth retrying; anything else (invalid key, plan restriction, monthly usage limit,
+# bad parameters) fails the same way every time and would only burn request quota.
+RETRYABLE_API_ERRORS = {"rate_limit_reached", "too_many_requests"}
+
+# Rows are always written with base_currency 'USD' and provider 'exchangerate.host'; both come from
+# the column DEFAULTs in schema.sql, so neither is sent with each row.
+BASE_CURRENCY = "USD"
+
+# One fetched chunk as parallel column lists (rate_date, symbol, rate); row dicts are only
+# built at the PostgREST edge, the Postgres path consumes the columns directly.
+RowCols = namedtuple("RowCols", "dates syms rates")
+
+# EWMA of recent HTTP 429s across all fetch threads; scales retry delays while the API is throttling us
+_congestion_ewma = 0.0
+_congestion_lock = threading.Lock()
+
+# libyaml-backed loader when available (much faster than the pure-Python one)
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@functools.lru_cache(maxsize=1)
 def load_config(path: str = "config.yaml") -> dict:
     with open(path, "r") as f:
-        return yaml.safe_load(f)
-    
+        return yaml.load(f, Loader=YamlLoader)
+
 
 def parse_date(s: str) -> dt.date:
     if s.lower() == "today":
@@ -59,14 +127,136 @@ def daterange_chunks(start: dt.date, end: dt.date, max_span_days: int = 365) ->
         cur = chunk_end + one_day
 
 
-def get_all_symbols(session: requests.Session, access_key: str) -> List[str]:
-    """Fetch the full list of supported currency codes. Costs 1 API request."""
+def _record_throttle(throttled: bool) -> float:
+    """Fold one response into the shared 429 EWMA and return the updated value."""
+    global _congestion_ewma
+    with _congestion_lock:
+        _congestion_ewma = 0.8 * _congestion_ewma + 0.2 * throttled
+        return _congestion_ewma
+
+
+def is_retryable(resp: requests.Response, data: Optional[dict] = None) -> bool:
+    """True for throttling and transient server errors; False for errors that won't change on retry."""
+    if resp.status_code == 429 or resp.status_code >= 500:
+        return True
+    if data is None:
+        # 2xx with an undecodable body (e.g. truncated response)
+        return resp.ok
+    error = data.get("error") or {}
+    return error.get("type") in RETRYABLE_API_ERRORS or error.get("code") == 429
+
+
+def retry_delay(resp: requests.Response, attempt: int, congestion: float) -> float:
+    """Seconds to wait before the next attempt: honour Retry-After, else full-jitter exponential backoff."""
+    delay = 0.0
+    if resp.status_code == 429:
+        try:
+            delay = float(resp.headers.get("Retry-After", 0))
+        except ValueError:
+            # HTTP-date form; fall back to backoff
+            delay = 0.0
+    if not delay:
+        delay = random.uniform(0, min(60, 2 ** attempt))
+    return delay * (1 + congestion)
+
+
+def http_session(cache_path: Optional[str]) -> requests.Session:
+    """Plain requests session, or an on-disk caching one if cache_path is set and requests-cache is installed."""
+    if not cache_path:
+        return requests.Session()
+    if CachedSession is None:
+        print("Missing optional dependency 'requests-cache'; HTTP cache disabled. Install with: pip install requests-cache")
+        return requests.Session()
+    # Cached entries never expire unless a request overrides it (see cache_kwargs);
+    # the access key is stripped from cache keys and stored requests.
+    return CachedSession(
+        cache_path,
+        backend="sqlite",
+        allowable_methods=("GET",),
+        expire_after=NEVER_EXPIRE,
+        ignored_parameters=["access_key"],
+    )
+
+
+def is_cached_session(session: requests.Session) -> bool:
+    return CachedSession is not None and isinstance(session, CachedSession)
+
+
+def evict(session: requests.Session, resp: requests.Response) -> None:
+    """Drop a response from the HTTP cache (API errors come back as HTTP 200 and would otherwise stick)."""
+    if is_cached_session(session):
+        session.cache.delete(requests=[resp.request])
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+class RequestQuota:
+    """
+    Admits at most max_per_run API calls in this process and monthly_quota per calendar month.
+    The month's usage is persisted to a small JSON state file so repeated runs share one budget.
+    None disables a limit.
+    """
+
+    def __init__(self, max_per_run: Optional[int], monthly_quota: Optional[int], state_path: Optional[str]):
+        self.lock = threading.Lock()
+        self.run_remaining = max_per_run
+        self.monthly_quota = monthly_quota
+        self.state_path = state_path
+        self.month = dt.date.today().strftime("%Y-%m")
+        self.used = 0
+        if state_path and os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            if state.get("month") == self.month:
+                self.used = state.get("used", 0)
+
+    def acquire(self) -> None:
+        """Take one request from the budget or raise QuotaExceeded."""
+        with self.lock:
+            if self.run_remaining is not None and self.run_remaining <= 0:
+                raise QuotaExceeded("max_requests_per_run reached")
+            if self.monthly_quota is not None and self.used >= self.monthly_quota:
+                raise QuotaExceeded(f"monthly request quota ({self.monthly_quota}) used up for {self.month}")
+            if self.run_remaining is not None:
+                self.run_remaining -= 1
+            self.used += 1
+            self._save()
+
+    def _save(self) -> None:
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"month": self.month, "used": self.used}, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def api_get(
+    session: requests.Session, quota: Optional[RequestQuota], url: str, params: dict, **kwargs
+) -> requests.Response:
+    """GET an API URL, charging the request quota only if it isn't served from the HTTP cache."""
+    if is_cached_session(session):
+        # requests-cache answers 504 instead of going to the network when there's no fresh entry
+        resp = session.get(url, params=params, only_if_cached=True, **kwargs)
+        if resp.status_code != 504:
+            return resp
+    if quota is not None:
+        quota.acquire()
+    return session.get(url, params=params, **kwargs)
+
+
+def get_all_symbols(session: requests.Session, access_key: str, quota: Optional[RequestQuota] = None) -> List[str]:
+    """Fetch the full list of supported currency codes. Costs 1 API request (unless cached within a day)."""
     url = "https://api.exchangerate.host/list"
     params = {"access_key": access_key}
-    r = session.get(url, params=params, timeout=30)
+    cache_kwargs = {"expire_after": dt.timedelta(days=1)} if is_cached_session(session) else {}
+    r = api_get(session, quota, url, params, timeout=30, **cache_kwargs)
     r.raise_for_status()
-    data = r.json()
+    data = json_loads(r.content)
     if not data.get("success", False):
+        evict(session, r)
         raise RuntimeError(f"/list failed: {data}")
     currencies = data["currencies"]
     return sorted(currencies.keys())
@@ -78,6 +268,7 @@ def fetch_timeframe(
     start: dt.date,
     end: dt.date,
     symbols: Optional[List[str]] = None,
+    quota: Optional[RequestQuota] = None,
 ) -> Dict[str, Dict[str, float]]:
     """
     Call /timeframe endpoint and return {date_str: {CURRENCY: rate, ...}, ...}
@@ -93,23 +284,32 @@ def fetch_timeframe(
     if symbols:
         params["currencies"] = ",".join(symbols)
 
-    for attempt in range(3):
-        resp = session.get(url, params=params, timeout=60)
+    # Historical ranges never change, so a cached chunk entirely in the past is reused forever;
+    # a chunk that includes today may still gain rates, so it is only reused for an hour.
+    cache_kwargs = {}
+    if is_cached_session(session):
+        cache_kwargs["expire_after"] = 3600 if end >= dt.date.today() else NEVER_EXPIRE
+
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        resp = api_get(session, quota, url, params, timeout=60, **cache_kwargs)
+        congestion = _record_throttle(resp.status_code == 429)
+        last_attempt = attempt == MAX_FETCH_ATTEMPTS - 1
         try:
             resp.raise_for_status()
-            data = resp.json()
+            data = json_loads(resp.content)
         except Exception as e:
-            if attempt == 2:
+            if last_attempt or not is_retryable(resp):
                 raise
-            time.sleep(2 ** attempt)
+            time.sleep(retry_delay(resp, attempt, congestion))
             continue
 
         if not data.get("success", False):
-            # Handle throttling and other API errors
+            # Only throttling is retried; other API errors are permanent and every retry costs quota
             info = data.get("error", {}).get("info") or data
-            if attempt == 2:
+            evict(session, resp)
+            if last_attempt or not is_retryable(resp, data):
                 raise RuntimeError(f"/timeframe error: {info}")
-            time.sleep(2 ** attempt)
+            time.sleep(retry_delay(resp, attempt, congestion))
             continue
 
         # Expect keys: success, timeframe, start_date, end_date, source, quotes={date: {USDEUR: x, ...}} OR rates style
@@ -121,33 +321,197 @@ def fetch_timeframe(
         if quotes is None:
             raise RuntimeError(f"Unexpected /timeframe payload shape: {list(data.keys())}")
 
-        # Normalize to {date: {SYM: rate, ...}} (strip leading 'USD' from pair keys if needed)
+        # Normalize to {date: {SYM: rate, ...}}. Keys are 'USDEUR' (quotes) or 'EUR' (rates);
+        # values are already JSON numbers, so no per-value type check or float() re-cast.
+        # The parsed payload is drained as it is normalized, so each raw per-date dict is
+        # freed as soon as its normalized counterpart is built.
         normalized = {}
-        for date_str, obj in quotes.items():
-            inner = {}
-            if isinstance(obj, dict):
-                for k, v in obj.items():
-                    if isinstance(v, (int, float)):
-                        # k may be 'USDEUR' or 'EUR'
-                        sym = k[3:] if k.startswith("USD") and len(k) == 6 else k
-                        inner[sym] = float(v)
-            normalized[date_str] = inner
+        while quotes:
+            date_str, obj = quotes.popitem()
+            normalized[date_str] = {k[3:] if len(k) == 6 else k: v for k, v in obj.items()}
         return normalized
 
     raise RuntimeError("Unreachable")
 
 
-def supabase_client() -> "Client":
+def supabase_credentials() -> Tuple[str, str]:
+    """(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) from the environment."""
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
     if not url or not key:
         raise EnvironmentError("Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in your environment or .env")
+    return url, key
+
+
+def supabase_client() -> "Client":
+    url, key = supabase_credentials()
     return create_client(url, key)
 
 
-def chunked(iterable: List[dict], size: int) -> Iterable[List[dict]]:
-    for i in range(0, len(iterable), size):
-        yield iterable[i : i + size]
+def supabase_rest_session() -> Tuple[requests.Session, str]:
+    """
+    Session preconfigured for PostgREST upserts, plus the REST base URL. Upserts go straight to
+    the REST endpoint so payloads are serialized once (with orjson when available) instead of
+    through supabase-py's stdlib-json request layer.
+    """
+    url, key = supabase_credentials()
+    session = requests.Session()
+    session.headers.update(
+        {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+            "Prefer": "resolution=merge-duplicates,return=minimal",
+        }
+    )
+    return session, f"{url.rstrip('/')}/rest/v1"
+
+
+def pg_connection():
+    """Open a direct Postgres connection if SUPABASE_DB_URL is set, else return None."""
+    dsn = os.environ.get("SUPABASE_DB_URL")
+    if not dsn:
+        return None
+    if psycopg2 is None:
+        raise ImportError("SUPABASE_DB_URL is set but 'psycopg2' is missing. Install with: pip install psycopg2-binary")
+    return psycopg2.connect(dsn)
+
+
+# A date counts as already loaded only once it has a row for every requested symbol, so adding a
+# symbol to the config backfills it and a date left half-written by an interrupted run is refetched.
+
+
+def pg_existing_dates(conn, table: str, start: dt.date, end: dt.date, symbols: List[str]) -> Set[str]:
+    """ISO dates in [start, end] that already have a rate for every one of `symbols`."""
+    wanted = sorted(set(symbols))
+    query = pgsql.SQL(
+        "SELECT rate_date FROM {} WHERE base_currency = %s AND symbol = ANY(%s) AND rate_date BETWEEN %s AND %s "
+        "GROUP BY rate_date HAVING count(*) = %s"
+    ).format(pgsql.Identifier(*table.split(".")))
+    with conn.cursor() as cur:
+        cur.execute(query, (BASE_CURRENCY, wanted, start, end, len(wanted)))
+        dates = {row[0].isoformat() for row in cur.fetchall()}
+    conn.commit()
+    return dates
+
+
+def rest_existing_dates(
+    client: "Client", table: str, start: dt.date, end: dt.date, symbols: List[str], page_size: int = 1000
+) -> Set[str]:
+    """
+    ISO dates in [start, end] that already have a rate for every one of `symbols`.
+    PostgREST can't group, so (rate_date, symbol) rows are paged through and counted per date.
+    """
+    wanted = sorted(set(symbols))
+    counts: Counter = Counter()
+    offset = 0
+    while True:
+        resp = (
+            client.table(table)
+            .select("rate_date,symbol")
+            .eq("base_currency", BASE_CURRENCY)
+            .in_("symbol", wanted)
+            .gte("rate_date", start.isoformat())
+            .lte("rate_date", end.isoformat())
+            .order("rate_date")
+            .order("symbol")
+            .range(offset, offset + page_size - 1)
+            .execute()
+        )
+        counts.update(r["rate_date"] for r in resp.data)
+        if len(resp.data) < page_size:
+            return {d for d, n in counts.items() if n == len(wanted)}
+        offset += page_size
+
+
+def chunk_is_present(chunk_start: dt.date, chunk_end: dt.date, existing: Set[str]) -> bool:
+    """True if every date in the inclusive chunk is already loaded."""
+    days = (chunk_end - chunk_start).days + 1
+    return all((chunk_start + dt.timedelta(days=i)).isoformat() in existing for i in range(days))
+
+
+def row_dicts(cols: RowCols) -> Iterable[dict]:
+    """Lazily materialize PostgREST row dicts from columnar chunk data."""
+    for date_str, sym, rate in zip(cols.dates, cols.syms, cols.rates):
+        yield {
+            "rate_date": date_str,
+            "symbol": sym,
+            "rate": rate,
+            # 'base_currency', 'provider' and 'fetched_at' will default on the DB side
+        }
+
+
+def pg_upsert(conn, table: str, cols: RowCols) -> int:
+    """
+    Upsert a chunk in one INSERT .. SELECT FROM unnest(...) statement with one array parameter per
+    column (psycopg2 still renders each array as an ARRAY[...] literal); returns the number of rows written.
+    Rates are cast to numeric[] (the column type) so they keep full precision; a float8 hop would round
+    them to 15 significant digits.
+    Does not commit: the whole run is one transaction, committed by main() once every chunk is written.
+    """
+    query = pgsql.SQL(
+        "INSERT INTO {} (rate_date, symbol, rate) "
+        "SELECT * FROM unnest(%s::date[], %s::text[], %s::numeric[]) "
+        "ON CONFLICT (rate_date, base_currency, symbol) DO UPDATE SET rate = EXCLUDED.rate"
+    ).format(pgsql.Identifier(*table.split(".")))
+    with conn.cursor() as cur:
+        cur.execute(query, (cols.dates, cols.syms, cols.rates))
+    return len(cols.dates)
+
+
+def chunked(iterable: Iterable[dict], size: int, max_bytes: Optional[int] = None) -> Iterable[List[dict]]:
+    """Yield lists of at most `size` items, shrunk so each list's JSON stays under ~max_bytes."""
+    it = iter(iterable)
+    first = next(it, None)
+    if first is None:
+        return
+    if max_bytes:
+        approx_row_bytes = len(json_dumps(first)) + 1  # +1 for the separating comma
+        size = max(1, min(size, max_bytes // approx_row_bytes))
+    it = itertools.chain([first], it)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def flush_rows(
+    session: requests.Session,
+    rest_url: str,
+    table: str,
+    cols: RowCols,
+    batch_size: int,
+    max_bytes: Optional[int] = None,
+) -> int:
+    """Upsert rows in batches of batch_size (and <= max_bytes of JSON); returns the number of rows written."""
+    url = f"{rest_url}/{table}"
+    params = {"on_conflict": "rate_date,base_currency,symbol"}
+    for batch in chunked(row_dicts(cols), batch_size, max_bytes):
+        resp = session.post(url, params=params, data=json_dumps(batch), timeout=120)
+        resp.raise_for_status()
+    return len(cols.dates)
+
+
+def upsert_stream(rows_q: "queue.Queue[Optional[RowCols]]", flush: Callable[[RowCols], int]) -> int:
+    """Consume per-chunk column data from rows_q until a None sentinel; returns the total rows upserted."""
+    total = 0
+    while True:
+        cols = rows_q.get()
+        if cols is None:
+            return total
+        total += flush(cols)
+
+
+def enqueue(rows_q: "queue.Queue[Optional[RowCols]]", item: Optional[RowCols], writer: Future) -> None:
+    """Put item on the bounded queue, surfacing the writer's exception instead of blocking forever if it died."""
+    while True:
+        try:
+            rows_q.put(item, timeout=1)
+            return
+        except queue.Full:
+            if writer.done():
+                writer.result()
 
 
 def main():
@@ -158,7 +522,17 @@ def main():
     symbols_arg = cfg.get("symbols", "CAD,EUR,GBP,TRY,AED")
     table = cfg.get("table", "exchange_rates")
     batch_days = cfg.get("batch_days", 365)
-    upsert_batch_size = cfg.get("upsert_batch_size", 1000)
+    upsert_batch_size = cfg.get("upsert_batch_size", 5000)
+    max_upsert_payload_bytes = cfg.get("max_upsert_payload_bytes", 6 * 1024 * 1024)
+    fetch_concurrency = cfg.get("fetch_concurrency", 8)
+    http_cache = cfg.get("http_cache", "fxcache.sqlite")
+    skip_existing = cfg.get("skip_existing", True)
+    upsert_workers = max(1, cfg.get("upsert_workers", 4))
+    quota = RequestQuota(
+        cfg.get("max_requests_per_run"),
+        cfg.get("monthly_request_quota", 100),
+        cfg.get("quota_state", "fx_quota.json"),
+    )
     dry_run = cfg.get("dry_run", False)
 
     if end < start:
@@ -168,11 +542,17 @@ def main():
     if not access_key:
         sys.exit("Missing EXCHANGERATE_HOST_KEY in .env")
 
-    session = requests.Session()
+    session = http_session(http_cache)
+    # Size the connection pool so concurrent chunk fetches don't queue on a single connection.
+    # pool_block keeps every request on a pooled keep-alive connection instead of opening
+    # (and discarding) extra TLS connections when all workers are busy.
+    pool_size = max(16, fetch_concurrency)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
 
     # Symbols to fetch
     if symbols_arg.strip().upper() == "ALL":
-        symbols = get_all_symbols(session, access_key)
+        symbols = get_all_symbols(session, access_key, quota)
         print(f"Fetched {len(symbols)} supported symbols.")
     else:
         symbols = [s.strip().upper() for s in symbols_arg.split(",") if s.strip()]
@@ -180,41 +560,103 @@ def main():
         if "USD" not in symbols:
             symbols.append("USD")
 
-    all_rows: List[dict] = []
-    print(f"Fetching USD rates from {start} to {end} in chunks (<= {batch_days} days each)...")
-
-    for chunk_start, chunk_end in daterange_chunks(start, end, max_span_days=batch_days):
-        data = fetch_timeframe(session, access_key, chunk_start, chunk_end, symbols=symbols)
-        count_days = 0
-        for date_str, inner in sorted(data.items()):
-            count_days += 1
-            for sym, rate in inner.items():
-                row = {
-                    "rate_date": date_str,
-                    "base_currency": "USD",
-                    "symbol": sym,
-                    "rate": float(rate),
-                    "provider": "exchangerate.host",
-                    # 'fetched_at' will default on the DB side
-                }
-                all_rows.append(row)
-        total_quotes = sum(len(v) for v in data.values())
-        print(f"  - {chunk_start}..{chunk_end}: {count_days} days, {total_quotes} quotes")
-
-    print(f"Prepared {len(all_rows)} rows to upsert into '{table}'.")
-
-    if dry_run:
-        print("Dry-run mode: exiting before DB write.")
+    # Rows are streamed to the DB one fetched chunk at a time through bounded queues (capping memory
+    # at a few chunks and overlapping upserts with fetches). On the PostgREST path rows are sharded by
+    # rate_date across upsert_workers writers, each with its own session, so writers never touch the
+    # same PK rows. The Postgres path uses a single writer and connection so the run is one transaction.
+    conn = None if dry_run else pg_connection()
+    # Closed on every exit path; without a commit, closing rolls the run's transaction back
+    try:
+        flushes: List[Callable[[RowCols], int]] = []
+        existing: Set[str] = set()
+        if conn is not None:
+            flushes = [functools.partial(pg_upsert, conn, table)]
+            if skip_existing:
+                existing = pg_existing_dates(conn, table, start, end, symbols)
+        elif not dry_run:
+            for _ in range(upsert_workers):
+                rest_session, rest_url = supabase_rest_session()
+                flushes.append(
+                    functools.partial(
+                        flush_rows,
+                        rest_session,
+                        rest_url,
+                        table,
+                        batch_size=upsert_batch_size,
+                        max_bytes=max_upsert_payload_bytes,
+                    )
+                )
+            if skip_existing:
+                existing = rest_existing_dates(supabase_client(), table, start, end, symbols)
+        queues: List["queue.Queue[Optional[RowCols]]"] = [queue.Queue(maxsize=4) for _ in flushes]
+        num_shards = max(1, len(flushes))
+        total_rows = 0
+        print(f"Fetching USD rates from {start} to {end} in chunks (<= {batch_days} days each)...")
+
+        # The provider charges per call, so a chunk with any missing date is refetched whole
+        chunks = []
+        for chunk_start, chunk_end in daterange_chunks(start, end, max_span_days=batch_days):
+            if chunk_is_present(chunk_start, chunk_end, existing):
+                print(f"  - {chunk_start}..{chunk_end}: already present, skipped")
+            else:
+                chunks.append((chunk_start, chunk_end))
+
+        # Chunks are independent, so fetch them concurrently to overlap network latency
+        with ThreadPoolExecutor(max_workers=fetch_concurrency) as ex, \
+                ThreadPoolExecutor(max_workers=num_shards) as writer_ex:
+            writers = [writer_ex.submit(upsert_stream, q, flush) for q, flush in zip(queues, flushes)]
+            futures = {
+                ex.submit(fetch_timeframe, session, access_key, cs, ce, symbols, quota): (cs, ce)
+                for cs, ce in chunks
+            }
+            try:
+                for fut in as_completed(futures):
+                    chunk_start, chunk_end = futures[fut]
+                    try:
+                        data = fut.result()
+                    except QuotaExceeded as e:
+                        # Nothing is written for this chunk; a later run fetches it once budget is available
+                        print(f"  - {chunk_start}..{chunk_end}: skipped, {e}")
+                        continue
+                    shards = [RowCols([], [], []) for _ in range(num_shards)]
+                    count_days = 0
+                    for date_str, inner in data.items():
+                        count_days += 1
+                        cols = shards[hash(date_str) % num_shards]
+                        # Bulk-extend each column per date; the per-quote work stays in C
+                        cols.dates.extend(itertools.repeat(date_str, len(inner)))
+                        cols.syms.extend(inner.keys())
+                        cols.rates.extend(inner.values())
+                    count_rows = sum(len(cols.dates) for cols in shards)
+                    total_rows += count_rows
+                    print(f"  - {chunk_start}..{chunk_end}: {count_days} days, {count_rows} quotes")
+                    for q, writer, cols in zip(queues, writers, shards):
+                        if cols.dates:
+                            enqueue(q, cols, writer)
+            except BaseException:
+                # Don't let queued chunks keep fetching (and spending request quota) for a run that's failing
+                ex.shutdown(wait=True, cancel_futures=True)
+                raise
+            finally:
+                for q, writer in zip(queues, writers):
+                    # A dead writer's exception is re-raised by result() below; keep signalling the others
+                    with contextlib.suppress(Exception):
+                        enqueue(q, None, writer)
+
+        if conn is not None and all(writer.exception() is None for writer in writers):
+            # Single commit for the whole run, only if the writer succeeded
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print(f"Prepared {total_rows} rows to upsert into '{table}'.")
+
+    if not writers:
+        print("Dry-run mode: skipped DB write.")
         return
 
-    client = supabase_client()
-    # Bulk upsert in chunks for stability
-    total = 0
-    for batch in chunked(all_rows, upsert_batch_size):
-        # If you created a PK on (rate_date, base_currency, symbol), PostgREST will use it for conflict resolution.
-        client.table(table).upsert(batch).execute()
-        total += len(batch)
-    print(f"Upserted {total} rows into '{table}'. Done.")
+    print(f"Upserted {sum(writer.result() for writer in writers)} rows into '{table}'. Done.")
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 -- schema.sql
 -- Run this in Supabase SQL editor (or psql) to create the exchange_rates table.
 
+-- fetch_usd_rates.py only sends (rate_date, symbol, rate); base_currency and provider come from the defaults below.
 create table if not exists public.exchange_rates (
   rate_date date not null,
   base_currency text not null default 'USD',